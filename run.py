@@ -2,10 +2,11 @@ import argparse
 import logging
 import logging.config
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import yaml
+from apscheduler.triggers.interval import IntervalTrigger
 from flask import Flask
 from flask_apscheduler import APScheduler
 from slack_bolt.adapter.socket_mode import SocketModeHandler
@@ -35,6 +36,7 @@ slack_config = config["slack"]
 slack_messages = slack_config["slack_messages"]
 slash_command = slack_config["slash_command"]
 slack_args = SlackSourceConfig(**slack_config["slack_args"])
+team_channel_id = os.environ[slack_config["team_channel_id"]]
 
 slack_conn = SlackConnector(
     bot_token=slack_config["bot_token"],
@@ -62,6 +64,12 @@ s3_conn = S3BucketConnector(
     bucket=s3_config["bucket"],
 )
 
+# Instantiate the background job scheduler & its polling interval in minutes
+scheduler = APScheduler()
+MIN_POLL_MINUTES = 2
+MAX_POLL_MINUTES = 60
+poll_minutes = 10
+
 
 @slack_conn._slack_app.command(slash_command)
 def open_ticket(ack: callable, command: dict):
@@ -72,34 +80,40 @@ def open_ticket(ack: callable, command: dict):
     slack_conn.open_form_view(trigger_id=trigger, form_view=form)
 
 
-@slack_conn._slack_app.view("form_1")
-def handle_submission(ack: callable, body: dict):
+def ack_submission(ack: callable):
     ack()
 
-    team_id = os.environ[slack_config["team_channel_id"]]
+
+def handle_submission(body: dict):
+    team_id = team_channel_id
     user_id, ticket = slack_conn.get_submitted_data(submission_body=body)
     user_success_msg = f"<@{user_id}> {slack_messages['success_msg_user']}"
     team_success_msg = f"{slack_messages['success_msg_team']} <@{user_id}>"
     user_fail_msg = f"{slack_messages['fail_msg_user']}"
     team_fail_msg = f"{slack_messages['fail_msg_team']} <@{user_id}>"
 
+    # transient Notion errors are retried by the connector's session
     status_code = notion_conn.post_object(ticket)
 
-    if status_code != 200:
-        time.sleep(3)
-        new_status_code = notion_conn.post_object(ticket)
-        if new_status_code == 200:
-            usr_msg = user_success_msg
-            tm_msg = team_success_msg
-        else:
-            usr_msg = user_fail_msg
-            tm_msg = team_fail_msg
-    else:
+    if status_code == 200:
         usr_msg = user_success_msg
         tm_msg = team_success_msg
+    else:
+        usr_msg = user_fail_msg
+        tm_msg = team_fail_msg
+
+    # the user & team messages are independent, post them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(slack_conn.post_message, slack_id=user_id, msg=usr_msg),
+            executor.submit(slack_conn.post_message, slack_id=team_id, msg=tm_msg),
+        ]
+        for future in futures:
+            future.result()
+
 
-    slack_conn.post_message(slack_id=user_id, msg=usr_msg)
-    slack_conn.post_message(slack_id=team_id, msg=tm_msg)
+# Acknowledge the form right away and run the Notion & Slack work as a lazy listener
+slack_conn._slack_app.view("form_1")(ack=ack_submission, lazy=[handle_submission])
 
 
 # Wrap ticket notifier & metafile process in a function to load into the Flask config
@@ -107,29 +121,61 @@ def background_jobs():
     ticket_notifier = CompletedTicketNotifier(
         notion=notion_conn,
         slack=slack_conn,
-        slack_channel=os.environ[slack_config["team_channel_id"]],
+        slack_channel=team_channel_id,
         s3=s3_conn,
     )
+    # generate updated metafile once and share it with the notifier
+    metafile = MetaProcess.generate_meta_file(notion_meta=notion_conn)
     # send notifications
-    ticket_notifier.notify()
+    new_work_found = ticket_notifier.notify(metafile)
 
     # S3 file cleanup date - delete anything older than yesterday
     yesterday = (datetime.today().date() - timedelta(days=1)).strftime(
         DateTimeFormats.datetime_format.value
     )
-    # delete old notification logs
-    MetaProcess.delete_meta_files(
-        s3_bucket_meta=s3_conn, prefix=s3_config['notifications_log_prefix'], date_threshold=yesterday
-    )
-    # generate updated metafile
-    metafile = MetaProcess.generate_meta_file(notion_meta=notion_conn)
-    # load updated metafile
-    MetaProcess.load_meta_file(
-        s3_bucket_meta=s3_conn, meta_file=metafile, prefix=s3_config['metafile_prefix']
-    )
-    # delete old metafiles
-    MetaProcess.delete_meta_files(
-        s3_bucket_meta=s3_conn, prefix=s3_config['metafile_prefix'], date_threshold=yesterday
+    # the cleanup & upload steps are independent S3 calls, run them concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            # delete old notification logs
+            executor.submit(
+                MetaProcess.delete_meta_files,
+                s3_bucket_meta=s3_conn,
+                prefix=s3_config["notifications_log_prefix"],
+                date_threshold=yesterday,
+            ),
+            # load updated metafile
+            executor.submit(
+                MetaProcess.load_meta_file,
+                s3_bucket_meta=s3_conn,
+                meta_file=metafile,
+                prefix=s3_config["metafile_prefix"],
+            ),
+            # delete old metafiles
+            executor.submit(
+                MetaProcess.delete_meta_files,
+                s3_bucket_meta=s3_conn,
+                prefix=s3_config["metafile_prefix"],
+                date_threshold=yesterday,
+            ),
+        ]
+        for future in futures:
+            future.result()
+
+    return new_work_found
+
+
+# Poll quickly while tickets are being completed and back off while Notion is quiet
+def adaptive_background_jobs():
+    global poll_minutes
+
+    if background_jobs():
+        poll_minutes = MIN_POLL_MINUTES
+    else:
+        poll_minutes = min(poll_minutes * 2, MAX_POLL_MINUTES)
+    logger.info(f"Next background job run in about {poll_minutes} minutes")
+    # jitter desynchronizes the polling of multiple app instances
+    scheduler.scheduler.reschedule_job(
+        "notifications", trigger=IntervalTrigger(minutes=poll_minutes, jitter=30)
     )
 
 
@@ -139,9 +185,10 @@ if __name__ == "__main__":
         JOBS = [
             {
                 "id": "notifications",
-                "func": background_jobs,
+                "func": adaptive_background_jobs,
                 "trigger": "interval",
-                "minutes": 10,
+                "minutes": poll_minutes,
+                "jitter": 30,
             }
         ]
         SCHEDULER_API_ENABLED = True
@@ -153,7 +200,6 @@ if __name__ == "__main__":
     # Instantiate and configure Flask app scheduler
     flask_app = Flask(__name__)
     flask_app.config.from_object(Config())
-    scheduler = APScheduler()
     scheduler.init_app(flask_app)
     scheduler.start()
 
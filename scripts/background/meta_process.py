@@ -2,7 +2,7 @@
 Methods for processing the meta file
 """
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 
 from scripts.common.constants import DateTimeFormats
 from scripts.common.notion import NotionConnector
@@ -39,7 +39,7 @@ class MetaProcess:
         s3_bucket_meta: S3BucketConnector, meta_file: list, prefix: str
     ) -> None:
         """
-        writing data to s3 bucket as a csv file
+        writing data to s3 bucket as a parquet file
 
         :param: s3_bucket_meta -> S3BucketConnector for the bucket with the meta file
         :param: meta_file -> list of dictionaries/records
@@ -50,8 +50,8 @@ class MetaProcess:
         log_date = now.strftime(DateTimeFormats.datetime_format.value)
         file_date = now.strftime(DateTimeFormats.date_file_name_format.value)
         meta_file = [{**file, **{"uploaded_at": log_date}} for file in meta_file]
-        file_name = f"{prefix}/{file_date}.csv"
-        s3_bucket_meta.write_to_s3(meta_file, file_name)
+        file_name = f"{prefix}/{file_date}.parquet"
+        s3_bucket_meta.write_parquet_to_s3(meta_file, file_name)
 
     @staticmethod
     def delete_meta_files(
@@ -67,15 +67,23 @@ class MetaProcess:
                 files older than this date will be deleted
         """
 
+        # S3 reports LastModified in UTC, compare tz-aware to tz-aware
         date_threshold = datetime.strptime(
             date_threshold, DateTimeFormats.datetime_format.value
+        ).replace(tzinfo=timezone.utc)
+        paginator = s3_bucket_meta._client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=s3_bucket_meta._bucket.name,
+            Prefix=prefix,
+            PaginationConfig={"PageSize": 1000},
         )
+        # the folder marker of the prefix is kept
+        marker = f"{prefix}/"
         to_delete = [
-            obj.key
-            for obj in s3_bucket_meta._bucket.objects.filter(Prefix=prefix)
-            if obj.last_modified.replace(tzinfo=None) < date_threshold
-            and obj.key != f"{prefix}/"
+            obj["Key"]
+            for page in pages
+            for obj in page.get("Contents", [])
+            if obj["LastModified"] < date_threshold and obj["Key"] != marker
         ]
         if to_delete:
-            for file in to_delete:
-                s3_bucket_meta.remove_object(f"{file}.csv")
+            s3_bucket_meta.bulk_delete(to_delete)
@@ -4,15 +4,34 @@ when their request is marked complete or launched.
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import NamedTuple
 
-from scripts.background.meta_process import MetaProcess
+import pandas as pd
+
 from scripts.common.constants import DateTimeFormats
 from scripts.common.notion import NotionConnector
 from scripts.common.s3 import S3BucketConnector
 from scripts.common.slack import SlackConnector
 
+DATETIME_FMT = DateTimeFormats.datetime_format.value
+DATE_FMT = DateTimeFormats.date_format.value
+
+
+@lru_cache(maxsize=512)
+def _fmt_date(timestamp: str) -> str:
+    """
+    Formatting a metafile timestamp as a date, cached since tickets
+    often share a creation day.
+
+    :param timestamp: string in the DATETIME_FMT format
+    returns:
+        str: the date in DATE_FMT format
+    """
+    return datetime.strptime(timestamp, DATETIME_FMT).date().strftime(DATE_FMT)
+
 
 class CompletedTicketNotifier:
     """
@@ -37,49 +56,54 @@ class CompletedTicketNotifier:
         self.slack = slack
         self.slack_channel = slack_channel
         self.s3 = s3
+        self.notif_log = []
+        # parse notion args
+        self._ticket_id = notion.notion_args.notion_page_ticket_id["text"]
+        self._ticket_status = notion.notion_args.notion_page_status["text"]
+        self._completed_labels = set(
+            notion.notion_args.notion_page_completion_labels["text"]
+        )
 
-    def get_completed_tickets(self) -> list:
+    def get_completed_tickets(self, current_meta_file: list) -> list:
         """
         Pulling latest completed tickets and filtering records that do
         not have notifications logged.
-        """
-
-        today = datetime.today().date()
-        week_ago = today - timedelta(days=7)
 
-        # parse notion args
-        ticket_status = self.notion.notion_args.notion_page_status["text"]
-        completed_labels = self.notion.notion_args.notion_page_completion_labels["text"]
-        ticket_id = self.notion.notion_args.notion_page_ticket_id["text"]
+        :param current_meta_file: the metafile generated from the Notion DB this run
+        returns:
+            list: records of newly completed tickets that require notifications
+        """
 
-        # generate new metafile
-        current_meta_file = MetaProcess.generate_meta_file(self.notion)
+        if not current_meta_file:
+            return []
+        df = pd.DataFrame(current_meta_file)
 
         # check the status of each ticket and filter to just those marked completed
-        completed_tickets = [
-            dct
-            for dct in current_meta_file
-            if dct[self.notion.notion_args.notion_page_status["text"]]
-            in completed_labels
-        ]
+        completed = df[df[self._ticket_status].isin(self._completed_labels)]
+        completed_ids = set(completed[self._ticket_id])
         self._logger.info(
-            f"Generated new metafile containing {len(completed_tickets)} completed tickets."
+            f"Generated new metafile containing {len(completed_ids)} completed tickets."
         )
         # check that the completed tickets were not marked as completed previously
-        filtered_tickets = self.__filter_records_marked_completed_not_notified(
-            completed_tickets
+        recent_ids = completed_ids - self.__get_previously_completed_tickets(
+            completed_ids
         )
+        self._logger.info(f"{len(recent_ids)} tickets were just marked as completed")
         # check the notification log to ensure that these ticket ids are not marked as notified
-        to_notify = self.__check_notifications_log(filtered_tickets)
-        return to_notify
+        to_notify_ids = recent_ids - self.__get_notified_tickets()
+        self._logger.info(f"Number of notifications to send: {len(to_notify_ids)}")
+        return [
+            rec for rec in current_meta_file if rec[self._ticket_id] in to_notify_ids
+        ]
 
-    def __filter_records_marked_completed_not_notified(self, completed_tickets) -> list:
+    def __get_previously_completed_tickets(self, completed_ids: set) -> set:
         """
-        Accessing the most recent metafile and filtering out
+        Accessing the most recent metafile and getting the ids of the
         tickets that were already marked as completed.
-        :param: completed_tickets -> a list of dictionaries from Notion that are marked as completed
+
+        :param: completed_ids -> ids of the tickets currently marked as completed
         returns:
-            list: a list of records that are newly marked as completed
+            set: ticket ids marked as completed in the previous metafile
         """
 
         try:
@@ -87,40 +111,34 @@ class CompletedTicketNotifier:
                 "data_tickets"
             )
             self._logger.info(f"Retrieved last metafile ->{last_metafile_name}")
-        except Exception as e:
+        except FileNotFoundError as e:
+            # without a baseline treat every completed ticket as already completed
+            # rather than notifying the whole history of the Notion board
             self._logger.debug(f"The last metafile cannot be accessed: {e}")
+            return completed_ids
+
         # get ticket id for tickets marked completed in the previous metafile
-        previously_completed_tickets = [
-            dct[self.notion.notion_args.notion_page_ticket_id["text"]]
-            for dct in last_meta_file
-            if dct[self.notion.notion_args.notion_page_status["text"]]
-            in self.notion.notion_args.notion_page_completion_labels["text"]
-        ]
-        self._logger.info(
-            f"{len(previously_completed_tickets)} previously completed tickets retrieved"
+        last_df = pd.DataFrame(
+            last_meta_file, columns=[self._ticket_id, self._ticket_status]
+        )
+        previously_completed_tickets = set(
+            last_df.loc[
+                last_df[self._ticket_status].isin(self._completed_labels),
+                self._ticket_id,
+            ]
         )
-        # get any tickets that were not yet marked completed in the previous metafile
-        recent_tickets = [
-            dct
-            for dct in completed_tickets
-            if dct[self.notion.notion_args.notion_page_ticket_id["text"]]
-            not in previously_completed_tickets
-        ]
         self._logger.info(
-            f"{len(recent_tickets)} tickets were just marked as completed"
+            f"{len(previously_completed_tickets)} previously completed tickets retrieved"
         )
-        return recent_tickets
+        return previously_completed_tickets
 
-    def __check_notifications_log(self, ticket_data: list) -> list:
+    def __get_notified_tickets(self) -> set:
         """
-        Accessing the most recent notifications log and filtering out
-        tickets that have successful notifications logged.
+        Accessing the most recent notifications log and getting the ids of
+        the tickets that have successful notifications logged.
 
-        :param tickets: a list of dictionaries each containing a completed ticket data.
         returns:
-            a filtered list of records that contain tickets that require completion
-            notifications
-
+            set: ticket ids of ticket owners that were successfully notified
         """
 
         try:
@@ -131,21 +149,12 @@ class CompletedTicketNotifier:
 
         except Exception as e:
             self._logger.debug(f"The latest notification log cannot be accessed :{e}")
-            return ticket_data
+            return set()
 
-        # get the ticket ids of ticket owners that were successfully notified
-        notified = [
-            ticket["ticket_id"]
-            for ticket in self.notif_log
-            if ticket["notification_status"] == "success"
-        ]
-        # filter out any tickets that were already successfully notified
-        ticket_id = self.notion.notion_args.notion_page_ticket_id["text"]
-        need_notifications = [
-            item for item in ticket_data if item[ticket_id] not in notified
-        ]
-        self._logger.info(f"Number of notifications to send: {len(need_notifications)}")
-        return need_notifications
+        log_df = pd.DataFrame(
+            self.notif_log, columns=["ticket_id", "notification_status"]
+        )
+        return set(log_df.loc[log_df["notification_status"] == "success", "ticket_id"])
 
     def send_notifications(self, meta_data: list) -> list:
         """
@@ -155,19 +164,24 @@ class CompletedTicketNotifier:
         returns:
             a list of records containing notification log data
         """
-        notifications_log = []
+        # parse notion args
+        notion_args = self.notion.notion_args
+        title_key = notion_args.notion_page_title["text"]
+        created_at_key = notion_args.notion_page_created_at["text"]
+        due_date_key = notion_args.notion_page_due_date["text"]
+        url_key = notion_args.notion_page_page_url["text"]
+        slack_id_key = notion_args.notion_page_slack_id["text"]
+        ticket_id_key = notion_args.notion_page_ticket_id["text"]
+
+        messages = []
         for rec in meta_data:
             # reference metafile keys to get values and use in a customized message
-            request_title = rec[self.notion.notion_args.notion_page_title["text"]]
-            created_at = rec[self.notion.notion_args.notion_page_created_at["text"]]
-            created_date = (
-                datetime.strptime(created_at, DateTimeFormats.datetime_format.value)
-                .date()
-                .strftime(DateTimeFormats.date_format.value)
-            )
-            deadline = rec[self.notion.notion_args.notion_page_due_date["text"]]
-            url = rec[self.notion.notion_args.notion_page_page_url["text"]]
-            user_id = rec[self.notion.notion_args.notion_page_slack_id["text"]]
+            request_title = rec[title_key]
+            created_at = rec[created_at_key]
+            created_date = _fmt_date(created_at)
+            deadline = rec[due_date_key]
+            url = rec[url_key]
+            user_id = rec[slack_id_key]
 
             # custome message for the ticket owner
             msg_to_user = f"""
@@ -185,22 +199,44 @@ class CompletedTicketNotifier:
             *Due Date*: {deadline} \n
             <{url}|:point_right: Review here.>
                     """
-            now = datetime.now().strftime(DateTimeFormats.datetime_format.value)
-            notification_record = {}
-            try:
-                self.slack.post_message(user_id, msg_to_user)
-                self.slack.post_message(self.slack_channel, msg_to_team)
-                notification_record["notification_status"] = "success"
-            except Exception as e:
-                notification_record["notification_status"] = "failed"
-                self._logger.info(f"Failed Notification - {e}")
-            notification_record["notified_at"] = now
-            notification_record["ticket_id"] = rec[
-                self.notion.notion_args.notion_page_ticket_id["text"]
+            messages.append((rec[ticket_id_key], user_id, msg_to_user, msg_to_team))
+
+        # post the messages for each ticket concurrently, Slack calls are I/O bound
+        notifications_log = []
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                (ticket_id, executor.submit(self.__post_ticket_messages, *msgs))
+                for ticket_id, *msgs in messages
             ]
-            notifications_log.append(notification_record)
+            for ticket_id, future in futures:
+                notification_record = {}
+                try:
+                    future.result()
+                    notification_record["notification_status"] = "success"
+                except Exception as e:
+                    notification_record["notification_status"] = "failed"
+                    self._logger.info(f"Failed Notification - {e}")
+                notification_record["notified_at"] = datetime.now().strftime(
+                    DATETIME_FMT
+                )
+                notification_record["ticket_id"] = ticket_id
+                notifications_log.append(notification_record)
         return notifications_log
 
+    def __post_ticket_messages(
+        self, user_id: str, msg_to_user: str, msg_to_team: str
+    ) -> None:
+        """
+        Posting the completion messages for one ticket to the ticket owner
+        and then to the team channel.
+
+        :param user_id: slack user id of the ticket owner
+        :param msg_to_user: message sent to the ticket owner
+        :param msg_to_team: message sent to the team channel
+        """
+        self.slack.post_message(user_id, msg_to_user)
+        self.slack.post_message(self.slack_channel, msg_to_team)
+
     def log_notifications(self, prefix: str, data: list) -> None:
         """
         Uploading the notifications log to the target S3 bucket.
@@ -210,21 +246,36 @@ class CompletedTicketNotifier:
         """
         today = datetime.now().strftime(DateTimeFormats.date_file_name_format.value)
         today_file_name = f"{prefix}/{today}.csv"
+        week_ago = (datetime.now() - timedelta(days=7)).strftime(DATETIME_FMT)
         # the previous notification log should have been retrieved in a prior method
         if self.notif_log:
-            data = data + self.notif_log
+            # only carry over the last week of notifications
+            retained = [rec for rec in self.notif_log if rec["notified_at"] >= week_ago]
+            data = data + retained
         else:
             self._logger.debug(f"The most recent notification log was not retrieved")
 
+        # keep the most recent notification for each ticket
+        latest = {}
+        for rec in sorted(data, key=lambda rec: rec["notified_at"]):
+            latest[rec["ticket_id"]] = rec
+        data = list(latest.values())
+
         self.s3.write_to_s3(data, today_file_name)
 
-    def notify(self) -> None:
+    def notify(self, meta_file: list) -> bool:
         """
         Get new contacts, send notifications, and log notification status to notify.
+
+        :param meta_file: the metafile generated from the Notion DB this run
+        returns:
+            bool: True if there were newly completed tickets to notify
         """
-        contacts = self.get_completed_tickets()
+        contacts = self.get_completed_tickets(meta_file)
         if contacts:
             log = self.send_notifications(contacts)
             self.log_notifications("notifications", log)
+            return True
         else:
             self._logger.info("No newly completed tickets at this time")
+            return False
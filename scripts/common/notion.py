@@ -4,16 +4,42 @@ import json
 import logging
 import os
 import re
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import NamedTuple
 
 import requests
 from dateutil import tz
 from flatten_json import flatten
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
+from urllib3.util.retry import Retry
 
 from scripts.common.constants import DateTimeFormats
 
+# matches the leading date of ISO formatted Notion timestamps
+_DATE_RE = re.compile(r"\d{4}[/-]\d{2}[/-]\d{2}")
+
+
+# builders for the json structure of each Notion page property type
+def _text(value: str) -> list:
+    return [{"type": "text", "text": {"content": value}}]
+
+
+def _title(value: str) -> dict:
+    return {"title": _text(value)}
+
+
+def _rich_text(value: str) -> dict:
+    return {"rich_text": _text(value)}
+
+
+def _date(value: str) -> dict:
+    return {"date": {"start": value}}
+
+
+def _url(value: str) -> dict:
+    return {"url": value}
+
 
 class NotionSourceConfig(NamedTuple):
     """
@@ -69,6 +95,46 @@ class NotionConnector:
             os.environ[notion_database_endpoint] + self.database_id + "/query"
         )
         self.notion_args = notion_args
+        # reuse connections across requests and retry transient failures with backoff
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        retries = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+        self._session.mount("https://", adapter)
+        # flattened Notion json keys mapped to the text fields in the config file
+        self._payload_key_map = {
+            field["json"]: field["text"] for field in notion_args if "json" in field
+        }
+        # gettz reads the zoneinfo files from disk, resolve it once
+        self._timezone = tz.gettz(DateTimeFormats.timezone.value)
+        # snapshot of the flattened Notion pages keyed by page id
+        self._pages = {}
+        self._last_seen_edit = None
+        self._last_full_sync = None
+        # Notion page properties paired with their Slack data keys & json structure
+        self._field_specs = [
+            ("Title", notion_args.notion_page_title["text"], _title),
+            ("Due Date", notion_args.notion_page_due_date["text"], _date),
+            (
+                "Requestor Name",
+                notion_args.notion_page_requestor_name["text"],
+                _rich_text,
+            ),
+            ("Requestor Email", notion_args.notion_page_email["text"], _rich_text),
+            (
+                "Request Details",
+                notion_args.notion_page_request_details["text"],
+                _rich_text,
+            ),
+            ("Slack ID", notion_args.notion_page_slack_id["text"], _rich_text),
+            ("URL", notion_args.notion_page_project_link["text"], _url),
+        ]
         self._logger = logging.getLogger(__name__)
 
     def __assemble_payload(self, data: dict) -> dict:
@@ -89,79 +155,13 @@ class NotionConnector:
             request_type = "None given"
             self._logger.info(f"The request type was not indicated properly.")
 
+        properties = {
+            name: wrapper(data.get(key)) for name, key, wrapper in self._field_specs
+        }
+        properties["Request Type"] = {"multi_select": request_type}
         payload = {
             "parent": {"type": "database_id", "database_id": self.database_id},
-            "properties": {
-                "Title": {
-                    "title": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": data.get(
-                                    self.notion_args.notion_page_title["text"]
-                                )
-                            },
-                        }
-                    ]
-                },
-                "Due Date": {
-                    "date": {
-                        "start": data.get(self.notion_args.notion_page_due_date["text"])
-                    }
-                },
-                "Requestor Name": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": data.get(
-                                    self.notion_args.notion_page_requestor_name["text"]
-                                )
-                            },
-                        }
-                    ]
-                },
-                "Requestor Email": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": data.get(
-                                    self.notion_args.notion_page_email["text"]
-                                )
-                            },
-                        }
-                    ]
-                },
-                "Request Details": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": data.get(
-                                    self.notion_args.notion_page_request_details["text"]
-                                )
-                            },
-                        }
-                    ]
-                },
-                "Request Type": {"multi_select": request_type},
-                "Slack ID": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": data.get(
-                                    self.notion_args.notion_page_slack_id["text"]
-                                )
-                            },
-                        }
-                    ]
-                },
-                "URL": {
-                    "url": data.get(self.notion_args.notion_page_project_link["text"])
-                },
-            },
+            "properties": properties,
         }
 
         return payload
@@ -175,12 +175,10 @@ class NotionConnector:
             str: status code of Notion api response
         """
         payload = self.__assemble_payload(data)
-        ticket_data = json.dumps(payload)
+        ticket_data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
 
         try:
-            response = requests.post(
-                self.pages_endpoint, headers=self.headers, data=ticket_data
-            )
+            response = self._session.post(self.pages_endpoint, data=ticket_data)
             self._logger.info(
                 f"Notion payload sent. Status code {response.status_code}"
             )
@@ -190,35 +188,66 @@ class NotionConnector:
 
         return response.status_code
 
-    def get_db_object(self, page_size=100) -> list:
+    def get_db_object(self, page_size=100, resync_hours=24) -> list:
         """
-        Getting the data stored in a Notion database.
+        Getting the data stored in a Notion database. After the first call only
+        pages edited since the previous call are requested and merged into an
+        in-memory snapshot of the database, which is rebuilt from a full query
+        every resync_hours.
 
         :param page_size: Indicate the length of responses to paginate through.
+        :param resync_hours: hours between full queries of the database
         returns:
             list: records containing data from each notion page
 
         """
         params = {"page_size": page_size}
-        response_length = page_size
-        data = []
+        now = datetime.now(timezone.utc)
+        # queries leave out archived & trashed pages, so a full query is the only
+        # way to drop them from the snapshot once they stop being edited
+        full_sync = (
+            self._last_full_sync is None
+            or now - self._last_full_sync >= timedelta(hours=resync_hours)
+        )
+        if full_sync:
+            snapshot = {}
+            last_seen_edit = None
+        else:
+            snapshot = self._pages
+            last_seen_edit = self._last_seen_edit
+            # only request the pages edited since the last query
+            params["filter"] = {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": last_seen_edit},
+            }
+        has_more = True
 
-        # paginate through all pages
-        while response_length == page_size:
+        # paginate through all pages using the cursor returned by Notion
+        while has_more:
             try:
-                response = requests.post(
-                    self.notion_db_full_url, headers=self.headers, json=params
-                )
-                re = response.json()
-                response_length = len(re)
-                pages = re.get("results")  # returns a list of nested json objects
-                records = [flatten(p) for p in pages]
-                data.extend(records)
+                response = self._session.post(self.notion_db_full_url, json=params)
+                body = response.json()
+                pages = body.get("results")  # returns a list of nested json objects
+                for p in pages:
+                    if p.get("archived") or p.get("in_trash"):
+                        snapshot.pop(p["id"], None)
+                    else:
+                        snapshot[p["id"]] = flatten(p)
+                    last_seen_edit = max(
+                        last_seen_edit or p["last_edited_time"], p["last_edited_time"]
+                    )
+                has_more = body.get("has_more", False)
+                params["start_cursor"] = body.get("next_cursor")
 
             except HTTPError as e:
                 self._logger.info(f"Notion API Error - {e.response}")
                 raise HTTPError
-        return data
+
+        self._pages = snapshot
+        self._last_seen_edit = last_seen_edit
+        if full_sync:
+            self._last_full_sync = now
+        return list(snapshot.values())
 
     def process_db_object(self, record_list) -> list:
         """
@@ -230,43 +259,25 @@ class NotionConnector:
             list: a normalized list of records for each notion page
         """
         preferred_datetime_format = DateTimeFormats.datetime_format.value
-        preferred_timezone = DateTimeFormats.timezone.value
-
-        key_lookup = {
-            self.notion_args[i]["json"]: self.notion_args[i]["text"]
-            for i in range(len(self.notion_args._fields))
-            if "json" in self.notion_args[i]
-        }
-        payload_keys = list(key_lookup.keys())
+        key_lookup = self._payload_key_map
 
         processed_data = []
         for dct in record_list:
-            # normalize headers
-            dct_lowercase = {
-                key.replace(" ", "_").lower(): value for key, value in dct.items()
-            }
-            # only take the data that are listed in the config file args
-            dct_parsed = {
-                key: value
-                for key, value in dct_lowercase.items()
-                if key in payload_keys
-            }
-            # replace the flattened json keys with simple text fields
-            dct_simple = {key_lookup[key]: value for key, value in dct_parsed.items()}
-            # reformat UTC date objects
-            datetime_objects = [
-                key
-                for key, value in dct_simple.items()
-                if value and re.match("\d{4}[/-]\d{2}[/-]\d{2}", value)
-            ]
-            dct_normalized = {
-                key: datetime.fromisoformat(value.replace("Z", ""))
-                .replace(tzinfo=timezone.utc)
-                .astimezone(tz=tz.gettz(preferred_timezone))
-                .strftime(preferred_datetime_format)
-                if key in datetime_objects
-                else value
-                for key, value in dct_simple.items()
-            }
-            processed_data.append(dct_normalized)
+            record = {}
+            for key, value in dct.items():
+                # normalize headers & only take the data listed in the config file args
+                text_key = key_lookup.get(key.replace(" ", "_").lower())
+                if text_key is None:
+                    continue
+                # reformat UTC date objects
+                if isinstance(value, str) and _DATE_RE.match(value):
+                    value = (
+                        datetime.fromisoformat(value.replace("Z", ""))
+                        .replace(tzinfo=timezone.utc)
+                        .astimezone(tz=self._timezone)
+                        .strftime(preferred_datetime_format)
+                    )
+                # replace the flattened json keys with simple text fields
+                record[text_key] = value
+            processed_data.append(record)
         return processed_data
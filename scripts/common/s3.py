@@ -4,10 +4,54 @@ import codecs
 import csv
 import logging
 import os
-from io import BytesIO, StringIO
-from typing import Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO, TextIOWrapper
+from typing import Dict, Iterable, Iterator, Tuple
 
 import boto3
+import pyarrow as pa
+import pyarrow.csv as pac
+import pyarrow.parquet as pq
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True,
+)
+
+# shared pool for listing the sub-prefixes of a prefix concurrently
+_LIST_EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+
+def _fieldnames(data: list) -> list:
+    """
+    Collecting the keys of every record in order of first appearance, records
+    can leave out keys such as the dates of undated Notion pages.
+
+    :param data: a list of dictionaries
+    returns:
+        list: the union of the record keys
+    """
+    return list(dict.fromkeys(key for rec in data for key in rec))
+
+
+def _to_table(data: list) -> pa.Table:
+    """
+    Building a pyarrow table with a column for every key found in the records,
+    pa.Table.from_pylist only takes the columns of the first record.
+
+    :param data: a list of dictionaries
+    returns:
+        pa.Table: the records as a table, missing values are null
+    """
+    return pa.Table.from_pydict(
+        {key: [rec.get(key) for rec in data] for key in _fieldnames(data)}
+    )
 
 
 class S3BucketConnector:
@@ -16,7 +60,15 @@ class S3BucketConnector:
     """
 
     def __init__(
-        self, access_key: str, secret_key: str, endpoint_url: str, bucket: str
+        self,
+        access_key: str,
+        secret_key: str,
+        endpoint_url: str,
+        bucket: str,
+        cache_ttl: int = 60,
+        list_ttl: int = 30,
+        max_concurrency: int = 8,
+        part_size: int = 8 * 1024 * 1024,
     ):
         """
         Constructor for S3BucketConnector
@@ -25,6 +77,10 @@ class S3BucketConnector:
         :param secret_key: secret key for accessing S3
         :param endpoint_url: endpoint url to S3
         :param bucket: S3 bucket name
+        :param cache_ttl: seconds the most recent file per prefix is cached for
+        :param list_ttl: seconds a prefix listing is cached for, 0 disables it
+        :param max_concurrency: number of parallel range requests per download
+        :param part_size: size in bytes of each range request
         """
 
         self._logger = logging.getLogger(__name__)
@@ -33,9 +89,17 @@ class S3BucketConnector:
             aws_access_key_id=os.environ[access_key],
             aws_secret_access_key=os.environ[secret_key],
         )
-        self._s3 = self.session.resource(service_name="s3")
-        self._client = self.session.client(service_name="s3")
+        # enough pooled connections for the concurrent listing & download threads
+        boto_config = Config(max_pool_connections=64)
+        self._s3 = self.session.resource(service_name="s3", config=boto_config)
+        self._client = self.session.client(service_name="s3", config=boto_config)
         self._bucket = self._s3.Bucket(os.environ[bucket])
+        self._cache_ttl = cache_ttl
+        self.max_concurrency = max_concurrency
+        self.part_size = part_size
+        self._latest_cache: Dict[str, Tuple[float, Tuple[list, str]]] = {}
+        self._list_ttl = list_ttl
+        self._list_cache: Dict[str, Tuple[float, list]] = {}
 
     def list_files_in_prefix(self, prefix: str) -> list:
         """
@@ -45,25 +109,209 @@ class S3BucketConnector:
         returns:
           list: file names containing the prefix in the key
         """
-        files = [obj.key for obj in self._bucket.objects.filter(Prefix=prefix)]
+        files = [obj["Key"] for obj in self.__list_objects(prefix)]
         return files
 
-    def read_csv(self, file_name: str) -> list:
+    def __list_objects(self, prefix: str) -> Iterable[dict]:
+        """
+        Helper function returning the object summaries with a prefix, listings are
+        cached for list_ttl seconds.
+
+        :param prefix: prefix on the S3 bucket that should be filtered with
+        returns:
+          Iterable: object summaries from the list_objects_v2 responses
+        """
+        if self._list_ttl <= 0:
+            return self.__iter_objects(prefix)
+
+        cached = self._list_cache.get(prefix)
+        if cached and time.monotonic() - cached[0] < self._list_ttl:
+            return cached[1]
+        objs = list(self.__iter_objects(prefix))
+        self._list_cache[prefix] = (time.monotonic(), objs)
+        return objs
+
+    def __invalidate_list_cache(self, keys: list) -> None:
+        """
+        Helper function dropping the cached listings of the prefixes of changed keys
+
+        :param keys: keys of the files written to or deleted from the bucket
+        """
+        for prefix in list(self._list_cache):
+            if any(key.startswith(prefix) for key in keys):
+                self._list_cache.pop(prefix, None)
+
+    def __iter_objects(self, prefix: str) -> Iterator[dict]:
+        """
+        Helper function yielding the key & modified date of every object with a prefix.
+        A prefix that fits in one page is listed with a single request, the rest of
+        a larger listing is split by sub-prefix and the sub-prefixes are listed
+        concurrently.
+
+        :param prefix: prefix on the S3 bucket that should be filtered with
+        returns:
+          Iterator: object summaries from the list_objects_v2 responses
+        """
+        first = self._client.list_objects_v2(
+            Bucket=self._bucket.name, Prefix=prefix, MaxKeys=1000
+        )
+        contents = first.get("Contents", [])
+        yield from contents
+        if not first.get("IsTruncated"):
+            return
+
+        # keys are listed in order, continue after the last key already yielded
+        start_after = contents[-1]["Key"]
+        paginator = self._client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self._bucket.name,
+            Prefix=prefix,
+            Delimiter="/",
+            PaginationConfig={"PageSize": 1000},
+        )
+        sub_prefixes = []
+        for page in pages:
+            yield from (
+                obj for obj in page.get("Contents", []) if obj["Key"] > start_after
+            )
+            sub_prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+
+        # a single sub-prefix gives nothing to parallelize, list it directly
+        if len(sub_prefixes) == 1:
+            yield from self.__list_shard(sub_prefixes[0], start_after)
+            return
+        # the low level client is thread safe and shared across the shards
+        futures = [
+            _LIST_EXECUTOR.submit(self.__list_shard, sub_prefix, start_after)
+            for sub_prefix in sub_prefixes
+        ]
+        for future in futures:
+            yield from future.result()
+
+    def __list_shard(self, prefix: str, start_after: str = "") -> list:
+        """
+        Helper function for self.__iter_objects() listing every object with a prefix
+
+        :param prefix: sub-prefix on the S3 bucket that should be filtered with
+        :param start_after: only list the keys after this key
+        returns:
+          list: object summaries from the list_objects_v2 responses
+        """
+        paginator = self._client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self._bucket.name,
+            Prefix=prefix,
+            StartAfter=start_after,
+            PaginationConfig={"PageSize": 1000},
+        )
+        return [obj for page in pages for obj in page.get("Contents", [])]
+
+    def read_csv_iter(self, file_name: str) -> Iterator[dict]:
+        """
+        streaming a csv file from the S3 bucket one row at a time
+
+        :param file_name: name of the file that should be read
+        returns:
+          Iterator: a dictionary for each line of a csv file
+        """
+        self._logger.info(
+            f"Reading file {self.endpoint_url} {self._bucket.name} {file_name}"
+        )
+        body = self._bucket.Object(key=file_name).get()["Body"]
+        yield from csv.DictReader(codecs.getreader("utf-8")(body))
+
+    def read_csv(self, file_name: str, use_pyarrow: bool = True) -> list:
         """
         reading a csv file from the S3 bucket and returning a list of dictionaires
 
         :param file_name: name of the file that should be read
+        :param use_pyarrow: parse with the pyarrow csv reader, set to False for
+            the csv.DictReader path
         returns:
           list: records containing each line of a csv file
         """
+        if not use_pyarrow:
+            return list(self.read_csv_iter(file_name))
+
         self._logger.info(
             f"Reading file {self.endpoint_url} {self._bucket.name} {file_name}"
         )
-        data = self._bucket.Object(key=file_name).get()
-        records = [
-            row for row in csv.DictReader(codecs.getreader("utf-8")(data["Body"]))
-        ]
-        return records
+        buf = self.__get_object_bytes(file_name)
+        if not buf:
+            return []
+        # read every column as a string to match csv.DictReader, no type inference
+        # slice out the header line only, splitting would copy the whole body
+        newline = buf.find(b"\n")
+        header_line = buf[:newline] if newline != -1 else buf
+        header = next(csv.reader([header_line.decode("utf-8")]))
+        convert_options = pac.ConvertOptions(
+            column_types={name: pa.string() for name in header}
+        )
+        table = pac.read_csv(pa.BufferReader(buf), convert_options=convert_options)
+        return table.to_pylist()
+
+    def __get_object_bytes(self, file_name: str) -> bytes or bytearray:
+        """
+        Helper function downloading a file from the s3 bucket. The first range
+        request returns the object size, the remaining ranges are fetched concurrently.
+
+        :param file_name: name of the file that should be downloaded
+        returns:
+          bytes | bytearray: the content of the file
+        """
+        try:
+            first = self._client.get_object(
+                Bucket=self._bucket.name,
+                Key=file_name,
+                Range=f"bytes=0-{self.part_size - 1}",
+            )
+        except ClientError as e:
+            # S3 rejects any range on an empty object
+            if e.response["Error"]["Code"] != "InvalidRange":
+                raise
+            obj = self._client.get_object(Bucket=self._bucket.name, Key=file_name)
+            return obj["Body"].read()
+        size = int(first["ContentRange"].split("/")[-1])
+        if size <= self.part_size:
+            return first["Body"].read()
+
+        buf = bytearray(size)
+        view = memoryview(buf)
+
+        def fetch(start: int) -> None:
+            end = min(start + self.part_size, size) - 1
+            # fail rather than stitch together parts of an object overwritten meanwhile
+            part = self._client.get_object(
+                Bucket=self._bucket.name,
+                Key=file_name,
+                Range=f"bytes={start}-{end}",
+                IfMatch=first["ETag"],
+            )
+            view[start : end + 1] = part["Body"].read()
+
+        view[: self.part_size] = first["Body"].read()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [
+                executor.submit(fetch, start)
+                for start in range(self.part_size, size, self.part_size)
+            ]
+            for future in futures:
+                future.result()
+        return buf
+
+    def read_parquet(self, file_name: str) -> list:
+        """
+        reading a parquet file from the S3 bucket and returning a list of dictionaires
+
+        :param file_name: name of the file that should be read
+        returns:
+          list: records containing each row of a parquet file
+        """
+        self._logger.info(
+            f"Reading file {self.endpoint_url} {self._bucket.name} {file_name}"
+        )
+        table = pq.read_table(pa.BufferReader(self.__get_object_bytes(file_name)))
+        return table.to_pylist()
 
     def get_most_recent_modified_file(self, prefix: str) -> Tuple[list, str]:
         """
@@ -71,47 +319,84 @@ class S3BucketConnector:
 
         :param prefix: the S3 directory containing the files you are looking for
         returns:
-            list: records containing each line of a csv file
+            list: records containing each line of a csv or parquet file
             str: name of the file that is returned
         """
-        file_dates = [
-            obj.last_modified.replace(tzinfo=None)
-            for obj in self._bucket.objects.filter(Prefix=prefix)
-            if obj != f"{prefix}/"
-        ]
-        file_dates.sort(reverse=True)
-        most_recent_date = file_dates[0]
-        files = [
-            obj.key
-            for obj in self._bucket.objects.filter(Prefix=prefix)
-            if obj.last_modified.replace(tzinfo=None) == most_recent_date
-            and obj != f"{prefix}/"
-        ]
-        file_name = files[0]
-        csv_obj = self.read_csv(file_name)
-        return csv_obj, file_name
+        cached = self._latest_cache.get(prefix)
+        if cached and time.monotonic() - cached[0] < self._cache_ttl:
+            return cached[1]
+
+        # list keys & modified dates only, the body of the newest file is read once
+        # walk the listing once keeping only the newest object, skip folder markers
+        best = None
+        for obj in self.__list_objects(prefix):
+            if obj["Key"].endswith("/"):
+                continue
+            if best is None or obj["LastModified"] > best["LastModified"]:
+                best = obj
+        if best is None:
+            raise FileNotFoundError(f"No files found in {self._bucket.name} {prefix}")
+        file_name = best["Key"]
+        if file_name.endswith(".parquet"):
+            records = self.read_parquet(file_name)
+        else:
+            records = self.read_csv(file_name)
+        self._latest_cache[prefix] = (time.monotonic(), (records, file_name))
+        return records, file_name
 
-    def write_to_s3(self, data: list, file_name: str) -> bool:
+    def write_to_s3(self, data: list, file_name: str, use_pyarrow: bool = True) -> bool:
         """
         writing a list of dictionaries to the indicated s3 bucket
         supports csv format only
 
         :param data: a list of dictionaries to be written as a csv file to s3
         :param file_name: the file_name it will be saved under
+        :param use_pyarrow: encode with the pyarrow csv writer, set to False for
+            the csv.DictWriter path
         returns:
             boolean value
         """
-        fields = list(data[0].keys())
         if not data:
             self._logger.info("The list is empty! No file will be written!")
             return None
+        elif use_pyarrow:
+            sink = pa.BufferOutputStream()
+            pac.write_csv(_to_table(data), sink)
+            return self.__put_object(BytesIO(sink.getvalue().to_pybytes()), file_name)
         else:
-            out_buffer = StringIO()
-            writer = csv.DictWriter(out_buffer, fieldnames=fields)
+            # encode rows straight into the upload buffer, no intermediate string
+            out_buffer = BytesIO()
+            text_buffer = TextIOWrapper(out_buffer, encoding="utf-8", newline="")
+            # the header covers every key, skip the per row key check
+            writer = csv.DictWriter(
+                text_buffer,
+                fieldnames=_fieldnames(data),
+                extrasaction="ignore",
+                lineterminator="\n",
+            )
             writer.writeheader()
             writer.writerows(data)
+            text_buffer.flush()
+            text_buffer.detach()
             return self.__put_object(out_buffer, file_name)
 
+    def write_parquet_to_s3(self, data: list, file_name: str) -> bool:
+        """
+        writing a list of dictionaries to the indicated s3 bucket
+        as a snappy compressed parquet file
+
+        :param data: a list of dictionaries to be written as a parquet file to s3
+        :param file_name: the file_name it will be saved under
+        returns:
+            boolean value
+        """
+        if not data:
+            self._logger.info("The list is empty! No file will be written!")
+            return None
+        out_buffer = BytesIO()
+        pq.write_table(_to_table(data), out_buffer, compression="snappy")
+        return self.__put_object(out_buffer, file_name)
+
     def __put_object(self, out_buffer: StringIO or BytesIO, file_name: str) -> bool:
         """
         Helper function for self.write_table_to_s3()
@@ -125,7 +410,15 @@ class S3BucketConnector:
         self._logger.info(
             f"Writing file to {self.endpoint_url} {self._bucket.name} {file_name}"
         )
-        self._bucket.put_object(Body=out_buffer.getvalue(), Key=file_name)
+        if isinstance(out_buffer, StringIO):
+            out_buffer = BytesIO(out_buffer.getvalue().encode("utf-8"))
+        out_buffer.seek(0)
+        # threaded multipart upload above the multipart threshold
+        self._bucket.upload_fileobj(out_buffer, Key=file_name, Config=TRANSFER_CONFIG)
+        # a new file invalidates the cached most recent file of its prefix
+        for prefix in [p for p in self._latest_cache if file_name.startswith(p)]:
+            self._latest_cache.pop(prefix, None)
+        self.__invalidate_list_cache([file_name])
         return True
 
     def remove_object(self, file_name: str) -> None:
@@ -136,4 +429,30 @@ class S3BucketConnector:
         """
 
         response = self._client.delete_object(Bucket=self._bucket.name, Key=file_name)
+        self.__invalidate_list_cache([file_name])
         self._logger.info(f"Deleted file {file_name} - {response}")
+
+    def bulk_delete(self, keys: list) -> None:
+        """
+        Deleting a list of files from the s3 bucket, up to 1000 keys per request
+
+        :param keys: full keys of the files to delete from bucket
+        """
+
+        for i in range(0, len(keys), 1000):
+            chunk = keys[i : i + 1000]
+            response = self._client.delete_objects(
+                Bucket=self._bucket.name,
+                Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+            )
+            # a quiet delete only reports the keys that could not be deleted
+            errors = response.get("Errors", [])
+            for error in errors:
+                self._logger.info(
+                    f"Failed to delete file {error['Key']} - {error['Code']} "
+                    f"{error['Message']}"
+                )
+            self._logger.info(
+                f"Deleted {len(chunk) - len(errors)} files from {self._bucket.name}"
+            )
+        self.__invalidate_list_cache(keys)
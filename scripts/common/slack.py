@@ -1,16 +1,70 @@
 """Connector and methods accessing Slack"""
 import logging
 import os
-from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import NamedTuple, Tuple
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, Iterator, NamedTuple, Tuple
 
-from flatten_json import flatten
 from slack_bolt import App
+from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
 
 from scripts.common.constants import DateTimeFormats
 
+# position of the due date calendar in the form blocks
+DUE_DATE_BLOCK = 5
+
+
+@lru_cache(maxsize=8)
+def _due_date(today_ordinal: int, offset: int, fmt: str) -> str:
+    """
+    Formats the date offset days from today, cached per day.
+
+    :param today_ordinal: proleptic Gregorian ordinal of today's date
+    :param offset: number of days added to today
+    :param fmt: strftime format of the returned date
+    returns:
+        str: the formatted date
+    """
+    return (date.fromordinal(today_ordinal) + timedelta(days=offset)).strftime(fmt)
+
+
+def _flatten_selective(
+    obj: dict, wanted: frozenset, prefixes: frozenset, sep: str = "_"
+) -> Iterator[Tuple[str, object]]:
+    """
+    Iteratively flattens nested json into keys joined by sep, the same way as
+    flatten_json.flatten, but only walks the branches leading to wanted keys.
+
+    :param obj: nested json payload
+    :param wanted: flattened keys that should be returned
+    :param prefixes: every partial key leading to a wanted key
+    :param sep: separator between the nested keys
+    returns:
+        Iterator: (flattened key, value) pairs for the wanted keys
+    """
+    stack = deque([("", obj)])
+    while stack:
+        prefix, node = stack.pop()
+        if prefix in wanted:
+            yield prefix, node
+            continue
+        if isinstance(node, dict):
+            children = list(node.items())
+        elif isinstance(node, list):
+            children = list(enumerate(node))
+        else:
+            continue
+        # push in reverse so keys are emitted in document order
+        for key, value in reversed(children):
+            child_key = f"{prefix}{sep}{key}" if prefix else str(key)
+            if child_key in wanted or child_key in prefixes:
+                stack.append((child_key, value))
+
 
 class SlackSourceConfig(NamedTuple):
     """
@@ -34,7 +88,12 @@ class SlackConnector:
     """
 
     def __init__(
-        self, bot_token: str, signing_secret: str, slack_args: SlackSourceConfig
+        self,
+        bot_token: str,
+        signing_secret: str,
+        slack_args: SlackSourceConfig,
+        user_cache_ttl: int = 3600,
+        user_cache_size: int = 1024,
     ):
         """
         Constructor for SlackConnector
@@ -43,26 +102,72 @@ class SlackConnector:
         :param signing_secret: secret key for accessing Slack API
         :parm app_token: app level token used in socket mode
         :param slack_args: NamedTuple class with Slack configuration data
+        :param user_cache_ttl: seconds a Slack user's name & email are cached for
+        :param user_cache_size: number of Slack users cached, the least recently
+            used user is dropped first
 
         """
         self._logger = logging.getLogger(__name__)
         self.bot_token = bot_token
+        # the token does not change for the life of the process, resolve it once
+        self._bot_token_value = os.environ[bot_token]
+        # one Web API client shared by the Bolt app & the connector methods
+        self._web = WebClient(token=self._bot_token_value, timeout=10)
+        # wait out the Retry-After of rate limited (429) responses & retry
+        self._web.retry_handlers.append(RateLimitErrorRetryHandler(max_retry_count=3))
         self._slack_app = App(
-            token=os.environ[self.bot_token], signing_secret=os.environ[signing_secret]
+            client=self._web, signing_secret=os.environ[signing_secret]
         )
         self.slack_args = slack_args
+        self._form_skeleton = self.__build_form_skeleton()
+        self._user_cache_ttl = user_cache_ttl
+        self._user_cache_size = user_cache_size
+        self._user_cache: Dict[str, Tuple[float, Tuple[str, str]]] = OrderedDict()
+        # submissions are handled on several threads, the Slack API call runs unlocked
+        self._user_cache_lock = threading.Lock()
+
+        # flattened Slack json keys mapped to the text fields in the config file
+        self._json_to_text = {}
+        for keys in slack_args.slack_json_keys.values():
+            if isinstance(keys["json"], list):
+                self._json_to_text.update({item: keys["text"] for item in keys["json"]})
+            else:
+                self._json_to_text[keys["json"]] = keys["text"]
+        self._wanted_keys = frozenset(self._json_to_text)
+        self._wanted_prefixes = frozenset(
+            key[:i] for key in self._wanted_keys for i, c in enumerate(key) if c == "_"
+        )
 
     def build_form_view(self) -> dict:
         """
-        Constructs the form layout using Slack block kit UI framework.
+        Constructs the form layout using Slack block kit UI framework. The static
+        layout is built once, only the due date is set per call.
         returns:
             dict: contains form content and modal blocks
         """
 
         # Create a timestamp to set a deadline no sooner than x days from today.
-        min_due_date = (
-            datetime.today().date() + timedelta(days=self.slack_args.min_days_until_due)
-        ).strftime(DateTimeFormats.date_format.value)
+        min_due_date = _due_date(
+            date.today().toordinal(),
+            self.slack_args.min_days_until_due,
+            DateTimeFormats.date_format.value,
+        )
+
+        # only copy the containers leading to the due date, the other blocks are shared
+        blocks = list(self._form_skeleton["blocks"])
+        due_date_block = blocks[DUE_DATE_BLOCK]
+        blocks[DUE_DATE_BLOCK] = {
+            **due_date_block,
+            "accessory": {**due_date_block["accessory"], "initial_date": min_due_date},
+        }
+        return {**self._form_skeleton, "blocks": blocks}
+
+    def __build_form_skeleton(self) -> dict:
+        """
+        Constructs the static form layout using Slack block kit UI framework.
+        returns:
+            dict: contains form content and modal blocks without a due date
+        """
 
         # format the request categories for a drop down menu
         category_names = list(self.slack_args.request_categories.keys())
@@ -166,7 +271,7 @@ class SlackConnector:
                     "accessory": {
                         "type": "datepicker",
                         "action_id": "duedate",
-                        "initial_date": min_due_date,
+                        "initial_date": None,
                         "placeholder": {"type": "plain_text", "text": "Select a date"},
                     },
                 },
@@ -185,9 +290,7 @@ class SlackConnector:
         """
 
         try:
-            result = self._slack_app.client.views_open(
-                trigger_id=trigger_id, view=form_view
-            )
+            result = self._web.views_open(trigger_id=trigger_id, view=form_view)
             self._logger.info(
                 f"Slash command triggered. Status code {result.status_code}"
             )
@@ -206,33 +309,17 @@ class SlackConnector:
 
         """
 
-        slack_json = self.slack_args.slack_json_keys
-        slack_keys = list(slack_json.keys())
-        data = flatten(submission_body)
-
-        lookup = {}
-        for key in slack_keys:
-            json_value = slack_json[key]["json"]
-            text_value = slack_json[key]["text"]
-            if not isinstance(json_value, list):
-                lookup[json_value] = text_value
-            else:
-                lookup = {**lookup, **{item: text_value for item in json_value}}
-
-        submission_keys = [k for k in data.keys() if k in lookup.keys()]
+        data = _flatten_selective(
+            submission_body, self._wanted_keys, self._wanted_prefixes
+        )
 
         submission_dct = defaultdict(list)
-        for key in submission_keys:
-            submission_dct[lookup[key]].append(data[key])
-
-        submission_data = {
-            k: (
-                submission_dct[k][0]
-                if len(submission_dct[k]) == 1
-                else submission_dct[k]
-            )
-            for k in submission_dct.keys()
-        }
+        for key, value in data:
+            submission_dct[self._json_to_text[key]].append(value)
+
+        submission_data = {}
+        for key, values in submission_dct.items():
+            submission_data[key] = values[0] if len(values) == 1 else values
         user_id = submission_data["slack_user_id"]
         updated_data = self.__update_user_info(user_id, submission_data)
         return user_id, updated_data
@@ -243,41 +330,70 @@ class SlackConnector:
         user id from the Slack API. It returns the status of
         the request and an updated dictionary.
 
-        :param data: a normalized dictionary of form data from Slack
+        :param data: a normalized dictionary of form data from Slack, it is mutated
         returns:
             dict: the submitted reponses with additional user info added
         """
 
-        try:
-            user_data = self._slack_app.client.users_info(
-                user=user_id, token=os.environ[self.bot_token]
-            )
-            profile = user_data.get("user").get("profile")
-            email = profile.get("email")
-            name = profile.get("real_name")
-            self._logger.info(f"Successfully parsed the Slack user profile for {name}")
-
-        except SlackApiError as e:
-            email = "No email"
-            name = f"Slack user id {user_id}"
-            self._logger.info(f"An API error has occured: {e.response}")
-
-        data = {**data, **{"email": email}}
+        with self._user_cache_lock:
+            cached = self._user_cache.get(user_id)
+            if cached and time.monotonic() - cached[0] >= self._user_cache_ttl:
+                # drop the stale profile so expired users do not pile up
+                self._user_cache.pop(user_id, None)
+                cached = None
+            if cached:
+                self._user_cache.move_to_end(user_id)
+        if cached:
+            self._logger.debug(f"Slack user profile cache hit for {user_id}")
+            email, name = cached[1]
+        else:
+            self._logger.debug(f"Slack user profile cache miss for {user_id}")
+            try:
+                user_data = self._web.users_info(
+                    user=user_id, token=self._bot_token_value
+                )
+                profile = user_data.get("user").get("profile")
+                email = profile.get("email")
+                name = profile.get("real_name")
+                self._logger.info(
+                    f"Successfully parsed the Slack user profile for {name}"
+                )
+                with self._user_cache_lock:
+                    self._user_cache[user_id] = (time.monotonic(), (email, name))
+                    if len(self._user_cache) > self._user_cache_size:
+                        self._user_cache.popitem(last=False)
+
+            except SlackApiError as e:
+                email = "No email"
+                name = f"Slack user id {user_id}"
+                self._logger.info(f"An API error has occured: {e.response}")
+
+        # the submitted data is updated in place
+        data["email"] = email
+        data["requestor_name"] = name
+        return data
 
-        data = {**data, **{"requestor_name": name}}
+    def invalidate_user_info(self, user_id: str = None) -> None:
+        """
+        Dropping cached Slack user profiles, e.g. after a profile update.
 
-        return data
+        :param user_id: slack user id to drop, all users are dropped if not given
+        """
+        with self._user_cache_lock:
+            if user_id is None:
+                self._user_cache.clear()
+            else:
+                self._user_cache.pop(user_id, None)
 
     def post_message(self, slack_id: str, msg: str) -> None:
         """
-        Helper function to post messages in Slack
+        Helper function to post messages in Slack. Rate limited requests are
+        retried by the WebClient retry handlers.
 
         :param slack_id: user id or channel id where the message will be sent
         :param msg: text of message being sent
 
         """
         block = [{"type": "section", "text": {"type": "mrkdwn", "text": msg}}]
-        self._slack_app.client.chat_postMessage(
-            channel=slack_id, blocks=block, text=msg
-        )
+        self._web.chat_postMessage(channel=slack_id, blocks=block, text=msg)
         self._logger.info(f"A message was sent to Slack ID {slack_id}")